@@ -1,12 +1,9 @@
-from dash import Dash, html, dcc, Input, Output, State
+from dash import Dash, html, dcc
 import dash_bootstrap_components as dbc
-from google import genai
 from dotenv import load_dotenv
-import os
 
 load_dotenv()
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-from responseTextAudio import generate_text_and_audio
+from chat_core import register_chat_callbacks
 
 # Create the app
 app = Dash(__name__, external_stylesheets=[dbc.themes.CYBORG])
@@ -42,7 +39,10 @@ app.layout = dbc.Container([
             html.Div([
                 dbc.Card([
                     dbc.CardBody([
-                        html.Div(id="chat-history", style={
+                        html.Div([
+                            html.Div(id="chat-history", children=[]),
+                            html.Div(id="stream-bubble")
+                        ], style={
                             "height": "400px",
                             "overflowY": "auto",
                             "backgroundColor": "#1e1e1e",
@@ -59,7 +59,10 @@ app.layout = dbc.Container([
                 ], className="mt-3"),
 
                 html.Audio(id="audio-player", controls=False, autoPlay=True),
-                dcc.Store(id="memory", data=[])
+                dcc.Store(id="session-id", storage_type="session"),
+                dcc.Store(id="audio-dummy"),
+                dcc.Store(id="stream-id"),
+                dcc.Interval(id="stream-poll", interval=150, disabled=True)
             ], style={
                 "display": "flex",
                 "flexDirection": "column",
@@ -72,61 +75,19 @@ app.layout = dbc.Container([
     ], style={"height": "100vh"})  # full viewport height for row
 ], fluid=True)
 
-# Callbacks
-@app.callback(
-    Output("chat-history", "children"),
-    Output("memory", "data", allow_duplicate=True),
-    Output("audio-player", "src"), 
-    Output("user-input", "value"),
-    Input("send-button", "n_clicks"),
-    State("user-input", "value"),
-    State("memory", "data"),
-    prevent_initial_call=True
-)
-def update_chat(n_clicks, user_message, history):
-    if not user_message:
-        return [html.Div("")], history, None, ""
-
-    # Append user message
-    history.append(("You", user_message))
-
-    # Generate bot response + audio
-    result = generate_text_and_audio(user_message, history, audio_cache_dir="assets")
-    bot_response = result["text"]
-    history.append((result["speaker"], bot_response))
-
-    # Format chat
-    chat_display = []
-    for sender, msg in history:
-        align = "left" if sender != "You" else "right"
-        color = "#5bc0de" if sender != "You" else "#f0ad4e"
-        chat_display.append(
-            html.Div([
-                html.Span(f"{sender}: ", style={"color": color, "fontWeight": "bold"}),
-                html.Span(msg)
-            ], style={"textAlign": align, "margin": "4px"})
-        )
-    
-    audio_src = "/" + result["audio_path"].replace("\\", "/") if os.path.exists(result["audio_path"]) else None
-
-    return chat_display, history, audio_src, ""
+def chat_bubble(sender, msg):
+    align = "left" if sender != "You" else "right"
+    color = "#5bc0de" if sender != "You" else "#f0ad4e"
+    return html.Div([
+        html.Span(f"{sender}: ", style={"color": color, "fontWeight": "bold"}),
+        html.Span(msg)
+    ], style={"textAlign": align, "margin": "4px"})
 
-# Client-side callback to play audio automatically
-app.clientside_callback(
-    """
-    function(src, history) {
-        if(src){
-            var audio = document.getElementById('audio-player');
-            audio.load();
-            audio.play();
-        }
-        return history;
-    }
-    """,
-    Output("memory", "data", allow_duplicate=True),  # dummy output
-    Input("audio-player", "src"),
-    State("memory", "data"),
-    prevent_initial_call=True
+register_chat_callbacks(
+    app,
+    chat_bubble,
+    bot_message=lambda state: (state["speaker"], state["text"]),
+    clear_input=True
 )
 
 if __name__ == "__main__":
@@ -1,15 +1,10 @@
-from dash import Dash, html, dcc, Input, Output, State
+from dash import Dash, html, dcc
 import dash_bootstrap_components as dbc
-from google import genai
 from dotenv import load_dotenv
-import os
 
 load_dotenv()
+from chat_core import register_chat_callbacks
 
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-from responseTextAudio import generate_text_and_audio
-
-# Create the app
 app = Dash(__name__, external_stylesheets=[dbc.themes.CYBORG])
 app.title = "Local Chat"
 
@@ -19,7 +14,10 @@ app.layout = dbc.Container([
 
     dbc.Card([
         dbc.CardBody([
-            html.Div(id="chat-history", style={
+            html.Div([
+                html.Div(id="chat-history", children=[]),
+                html.Div(id="stream-bubble")
+            ], style={
                 "height": "400px",
                 "overflowY": "auto",
                 "backgroundColor": "#1e1e1e",
@@ -36,70 +34,24 @@ app.layout = dbc.Container([
     ], className="mt-3"),
 
     html.Audio(id="audio-player", controls=False, autoPlay=True),
-    dcc.Store(id="memory", data=[]),
+    dcc.Store(id="session-id", storage_type="session"),
+    dcc.Store(id="audio-dummy"),
+    dcc.Store(id="stream-id"),
+    dcc.Interval(id="stream-poll", interval=150, disabled=True),
 ], fluid=True)
 
-# Callbacks
-@app.callback(
-    Output("chat-history", "children"),
-    Output("memory", "data", allow_duplicate=True),
-    Output("audio-player", "src"), 
-    Input("send-button", "n_clicks"),
-    State("user-input", "value"),
-    State("memory", "data"),
-    prevent_initial_call=True
-)
-def update_chat(n_clicks, user_message, history):
-    if not user_message:
-        return [html.Div(""), history]
-
-    # Append user message
-    history.append(("You", user_message))
-
-    # (Optional) Simple AI echo or bot response
-
-    # response = client.models.generate_content(model="gemini-2.5-flash", contents=user_message)
-    # Generate text + audio
-    result = generate_text_and_audio(user_message, history, audio_cache_dir="assets")
-    bot_response = result["display_line"]
-
-    #result["audio_path"]
-    # audio_src = result["audio_src_base64"]  # may be None on TTS error
-    print(bot_response)
-
-    history.append(("Bot", bot_response))
-
-    # Format chat
-    chat_display = []
-    for sender, msg in history:
-        align = "left" if sender == "Bot" else "right"
-        color = "#5bc0de" if sender == "Bot" else "#f0ad4e"
-        chat_display.append(
-            html.Div([
-                html.Span(f"{sender}: ", style={"color": color, "fontWeight": "bold"}),
-                html.Span(msg)
-            ], style={"textAlign": align, "margin": "4px"})
-        )
-    
-    audio_src = "/" + result["audio_path"].replace("\\", "/") if os.path.exists(result["audio_path"]) else None
-
-    return chat_display, history, audio_src
-
-app.clientside_callback(
-    """
-    function(src, history) {
-        if(src){
-            var audio = document.getElementById('audio-player');
-            audio.load();
-            audio.play();
-        }
-        return history;
-    }
-    """,
-    Output("memory", "data", allow_duplicate=True),  # dummy output, memory used as placeholder
-    Input("audio-player", "src"),
-    State("memory", "data"),
-    prevent_initial_call = True
+def chat_bubble(sender, msg):
+    align = "left" if sender == "Bot" else "right"
+    color = "#5bc0de" if sender == "Bot" else "#f0ad4e"
+    return html.Div([
+        html.Span(f"{sender}: ", style={"color": color, "fontWeight": "bold"}),
+        html.Span(msg)
+    ], style={"textAlign": align, "margin": "4px"})
+
+register_chat_callbacks(
+    app,
+    chat_bubble,
+    bot_message=lambda state: ("Bot", state.get("display_line") or f"{state['speaker']}: {state['text']}")
 )
 
 if __name__ == "__main__":
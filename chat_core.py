@@ -0,0 +1,199 @@
+# chat_core.py
+"""
+Chat state and callbacks shared by app.py and app_test.py.
+
+Both apps have the same chat-history / stream-bubble / send-button / stream-poll
+components; they differ only in layout and in how a bubble is drawn. Each app
+builds its own layout and then calls register_chat_callbacks() with its bubble
+formatting, so the session, streaming and polling logic lives in one place.
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from dash import Input, Output, State, Patch, no_update
+
+from responseTextAudio import stream_text_and_audio
+
+# In-flight bot replies keyed by stream id: a worker thread fills them, the UI polls them
+STREAMS = {}
+# Finished replies nobody polled (e.g. the tab reloaded mid-stream) are dropped after this
+STREAM_TTL = 60
+
+# Chat history lives server-side, keyed by the browser's session id, and is bounded
+# so neither the prompt context nor a callback's work grows with the conversation
+HISTORY_WINDOW = 40
+# Least-recently-used sessions are evicted so the dict itself stays bounded too
+MAX_SESSIONS = 256
+SESSIONS: "OrderedDict[str, deque]" = OrderedDict()
+_SESSIONS_LOCK = threading.Lock()
+
+def get_history(session_id):
+    with _SESSIONS_LOCK:
+        history = SESSIONS.get(session_id)
+        if history is None:
+            history = SESSIONS[session_id] = deque(maxlen=HISTORY_WINDOW)
+        SESSIONS.move_to_end(session_id)
+        while len(SESSIONS) > MAX_SESSIONS:
+            SESSIONS.popitem(last=False)
+        return history
+
+def remember(history, sender, msg):
+    """Append to the session history; returns whether the oldest entry fell out."""
+    full = len(history) == history.maxlen
+    history.append((sender, msg))
+    return full
+
+def append_bubble(bubble, drop_oldest):
+    # Patch in just the new bubble; once the window is full also drop the oldest one,
+    # so the DOM is bounded by HISTORY_WINDOW just like the server-side history
+    chat_display = Patch()
+    if drop_oldest:
+        del chat_display[0]
+    chat_display.append(bubble)
+    return chat_display
+
+def _sweep_streams():
+    cutoff = time.monotonic() - STREAM_TTL
+    for stream_id, state in list(STREAMS.items()):
+        if state.get("finished_at", cutoff) < cutoff:
+            STREAMS.pop(stream_id, None)
+
+def _run_stream(stream_id, user_message, history, session_history, session_id, bot_message):
+    state = STREAMS[stream_id]
+    try:
+        for update in stream_text_and_audio(user_message, history, audio_cache_dir="assets", session_id=session_id):
+            state.update(update)
+    except Exception as e:
+        # Don't leave the UI polling forever on a failed call
+        print("Stream error:", e)
+    finally:
+        # Commit the reply here rather than in poll_stream, so it reaches history
+        # even if the tab reloads mid-stream and nothing polls this stream again
+        if state["text"]:
+            sender, msg = state["reply"] = bot_message(state)
+            if os.getenv("FATEWEAVER_DEBUG") == "1":
+                print(msg)
+            state["drop_oldest"] = remember(session_history, sender, msg)
+        state["finished_at"] = time.monotonic()
+        state["done"] = True
+
+def register_chat_callbacks(app, chat_bubble, bot_message, clear_input=False):
+    """
+    Wire the shared chat callbacks into app.
+
+    chat_bubble(sender, msg) renders one history entry; bot_message(state) turns a
+    stream state ({speaker, text, ...}) into the (sender, msg) pair that is shown
+    and kept in history. clear_input also empties user-input after each send.
+    """
+    input_output = [Output("user-input", "value")] if clear_input else []
+    input_value = [""] if clear_input else []
+
+    @app.callback(
+        Output("chat-history", "children"),
+        *input_output,
+        Output("stream-id", "data"),
+        Output("stream-poll", "disabled"),
+        Output("session-id", "data"),
+        Output("send-button", "disabled"),
+        Input("send-button", "n_clicks"),
+        State("user-input", "value"),
+        State("session-id", "data"),
+        State("stream-id", "data"),
+        prevent_initial_call=True
+    )
+    def update_chat(n_clicks, user_message, session_id, active_stream_id):
+        # One reply at a time per tab: a second send would orphan the running stream
+        if not user_message or active_stream_id in STREAMS:
+            return (no_update,) * (5 + len(input_output))
+
+        # First message from this browser tab: give it its own session (written back only then,
+        # so restore_chat doesn't redraw the whole transcript on every send)
+        new_session_id = no_update if session_id else uuid.uuid4().hex
+        session_id = session_id or new_session_id
+
+        # Append user message (only the new bubble goes over the wire, not the whole transcript)
+        history = get_history(session_id)
+        drop_oldest = remember(history, "You", user_message)
+        chat_display = append_bubble(chat_bubble("You", user_message), drop_oldest)
+
+        # Generate bot response + audio in the background; poll_stream renders it as it arrives
+        _sweep_streams()
+        stream_id = uuid.uuid4().hex
+        STREAMS[stream_id] = {"speaker": "Narrator", "text": "", "done": False}
+        threading.Thread(
+            target=_run_stream,
+            args=(stream_id, user_message, list(history), history, session_id, bot_message),
+            daemon=True
+        ).start()
+
+        # Send stays disabled until poll_stream has shown this reply
+        return (chat_display, *input_value, stream_id, False, new_session_id, True)
+
+    @app.callback(
+        Output("chat-history", "children", allow_duplicate=True),
+        Output("stream-bubble", "children"),
+        Output("audio-player", "src"),
+        Output("stream-poll", "disabled", allow_duplicate=True),
+        Output("send-button", "disabled", allow_duplicate=True),
+        Input("stream-poll", "n_intervals"),
+        State("stream-id", "data"),
+        prevent_initial_call=True
+    )
+    def poll_stream(n_intervals, stream_id):
+        state = STREAMS.get(stream_id)
+        if state is None:
+            return no_update, None, no_update, True, False
+
+        # Still generating: show the partial line without committing it to history
+        if not state.get("done"):
+            # Nothing new since the last tick: skip the re-render entirely
+            if state["text"] == state.get("shown"):
+                return no_update, no_update, no_update, False, no_update
+            state["shown"] = state["text"]
+            sender, msg = bot_message({**state, "text": state["text"] or "..."})
+            return no_update, chat_bubble(sender, msg), no_update, False, no_update
+
+        # _run_stream already committed the reply to history; only render it here
+        STREAMS.pop(stream_id, None)
+        chat_display = no_update
+        if state.get("reply"):
+            chat_display = append_bubble(chat_bubble(*state["reply"]), state["drop_oldest"])
+
+        audio_path = state.get("audio_path")
+        audio_src = "/" + audio_path.replace("\\", "/") if audio_path and os.path.exists(audio_path) else None
+
+        return chat_display, None, audio_src, True, False
+
+    @app.callback(
+        Output("chat-history", "children", allow_duplicate=True),
+        Input("session-id", "modified_timestamp"),
+        State("session-id", "data"),
+        prevent_initial_call="initial_duplicate"
+    )
+    def restore_chat(ts, session_id):
+        # A reload keeps its session id (sessionStorage), so redraw what the server
+        # still remembers; this also keeps the DOM in step with the bounded deque
+        if not session_id:
+            return no_update
+        return [chat_bubble(sender, msg) for sender, msg in get_history(session_id)]
+
+    # Client-side callback to play audio automatically
+    app.clientside_callback(
+        """
+        function(src) {
+            if(src){
+                var audio = document.getElementById('audio-player');
+                audio.load();
+                audio.play();
+            }
+            return src;
+        }
+        """,
+        Output("audio-dummy", "data"),  # dummy output
+        Input("audio-player", "src"),
+        prevent_initial_call=True
+    )
@@ -0,0 +1,24 @@
+# llm_client.py
+"""
+Single shared Gemini client for the whole process.
+
+Every module that talks to Gemini should call get_genai_client() instead of
+building its own genai.Client, so SDK setup happens once and all callers share
+the same underlying HTTP connection pool.
+"""
+
+import os
+from functools import lru_cache
+
+from dotenv import load_dotenv
+from google import genai
+
+load_dotenv()
+
+
+@lru_cache(maxsize=1)
+def get_genai_client() -> genai.Client:
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        raise RuntimeError("Missing GEMINI_API_KEY in environment (.env).")
+    return genai.Client(api_key=api_key)
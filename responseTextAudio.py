@@ -1,24 +1,30 @@
 # responseTextAudio.py
 from __future__ import annotations
 import os
+import re
 import json
-import base64
+import hashlib
+import unicodedata
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Optional, Iterator
 
+import orjson
 from dotenv import load_dotenv
-from google import genai
 
 # TTS helper (uses Eleven v3 Alpha inside your tts.py)
-from tts import synthesize_line_mp3
+from tts import synthesize_line_mp3, ensure_voice_id_for_character_in_file, safe_filename, atomic_write_bytes
+import semantic_cache
+from llm_client import get_genai_client
 
 # ---------- Setup ----------
 load_dotenv()
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    raise RuntimeError("Missing GEMINI_API_KEY in environment (.env).")
-
-client = genai.Client(api_key=GEMINI_API_KEY)
+# Shared process-wide client; raises at import if GEMINI_API_KEY is missing
+client = get_genai_client()
+GEMINI_MODEL = "gemini-2.5-flash"
 
 # Role text (we'll prepend this into the prompt since system_instruction isn't supported here)
 ROLE = (
@@ -35,12 +41,12 @@ CHAR_PATH = Path("characters.json")
 SET_PATH  = Path("setting.json")
 
 def _load_json(path: Path) -> Any:
-    return json.loads(path.read_text(encoding="utf-8")) if path.exists() else None
+    return orjson.loads(path.read_bytes()) if path.exists() else None
 
 CHARACTERS: List[Dict[str, Any]] = _load_json(CHAR_PATH) or []
 SETTINGS: Dict[str, Any] = _load_json(SET_PATH) or {}
 
-CHAR_NAMES = [c.get("name") for c in CHARACTERS if c.get("name")]
+CHAR_NAMES_SET = frozenset(c["name"] for c in CHARACTERS if c.get("name"))
 LOCATION_IDS: List[str] = []
 for loc in (SETTINGS.get("locations") or []):
     if loc.get("id"):
@@ -49,17 +55,197 @@ for loc in (SETTINGS.get("locations") or []):
         if sub.get("id"):
             LOCATION_IDS.append(sub["id"])
 
-# Schema prompt to force strict JSON
-RESPONSE_SCHEMA = (
-    "Return ONLY valid JSON with this exact shape and keys:\n"
-    "{"
-    '"speaker": "<one of: ' + ", ".join(sorted(set(CHAR_NAMES + ["Narrator"]))) + '>", '
-    '"text": "<the exact dialogue or narration to say>", '
-    '"location": "<optional: one of the known location ids or empty string>"'
-    "}\n"
-    "Do not include markdown fences or extra text."
+# Structured-output schema: Gemini returns (and validates) strict JSON server-side
+@functools.cache
+def _response_schema() -> Dict[str, Any]:
+    return {
+        "type": "object",
+        "properties": {
+            "speaker": {"type": "string", "enum": sorted(CHAR_NAMES_SET | {"Narrator"})},
+            "text": {"type": "string", "description": "The exact dialogue or narration to say."},
+            "location": {"type": "string", "description": "One of the known location ids, or empty."},
+        },
+        "required": ["speaker", "text"],
+    }
+
+# World briefs (short to keep prompt small): only the first 60 characters are described
+CHAR_BRIEFS_JOINED = "\n- ".join(
+    f"{c.get('name')}: {(c.get('personality') or '')} | {(c.get('background') or '')}"
+    for c in CHARACTERS[:60]
+)
+LOCATIONS_BRIEF = ", ".join(LOCATION_IDS)
+
+# Everything in the prompt that does not change per turn, built once at import.
+# Static text goes first so every request shares a byte-identical prefix.
+PROMPT_PREFIX = (
+    ROLE + "\n"
+    "WORLD DATA:\n"
+    "Characters:\n- " + CHAR_BRIEFS_JOINED + "\n\n"
+    "Known locations: " + LOCATIONS_BRIEF + "\n\n"
+    "TASK:\n"
+    "Using the world data, produce an in-world response as either an appropriate character "
+    "or the Narrator, if an appropriate character to respond is not available. You can be verbose, but "
+    "do not go beyond five sentences. You may include bracketed directions like [cautiously] "
+    "at the start of the line to express emotion or voice acting direction.\n\n"
+    "At all costs to maintain immersion, you are not to acknowledge that you are an AI or virtual assistant. If "
+    "the input response from the player is immersion breaking (i.e. dropping a nuclear bomb in a medieval setting), "
+    "do not allow it and instead reframe the response to be in universe (i.e. 'Narrator: Although you say this, you do not "
+    "know what a nuclear bomb is'). Only allow the player to do actions that are capable for humans to do in this fantasy medieval setting. "
+    "Also, do not allow the player to direct the actions of others. Only do so in context that makes sense (i.e. the player cannot specify "
+    "that a character performed a specific action, but can see another character performing an action)"
+    "\n\n"
 )
 
+# ---------- Response cache ----------
+# Exact-match LRU of prompt -> raw model output, persisted so restarts stay warm.
+LLM_CACHE_PATH = Path("assets") / ".llm_cache.jsonl"
+LLM_CACHE_SIZE = 512
+
+def _normalize(s: str) -> str:
+    return unicodedata.normalize("NFC", s).strip()
+
+def _cache_key(model: str, prompt: str) -> str:
+    payload = json.dumps({"model": model, "prompt": _normalize(prompt)}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# Cache persistence is fire-and-forget; one worker keeps file writes ordered
+_IO_POOL = ThreadPoolExecutor(max_workers=1)
+# Shared by all request threads; every read/modify of _LLM_CACHE goes through it
+_LLM_CACHE_LOCK = threading.Lock()
+
+def _load_llm_cache(path: Path) -> "Tuple[OrderedDict[str, str], int]":
+    """Returns (cache, number of lines in the file) so callers know when to compact."""
+    cache: "OrderedDict[str, str]" = OrderedDict()
+    if not path.exists():
+        return cache, 0
+    lines = path.read_bytes().splitlines()
+    for line in lines:
+        try:
+            entry = orjson.loads(line)
+            if not isinstance(orjson.loads(entry["raw"]), dict):
+                continue  # only well-formed model output is ever served from cache
+            cache[entry["key"]] = entry["raw"]
+            cache.move_to_end(entry["key"])
+        except Exception:
+            continue
+    while len(cache) > LLM_CACHE_SIZE:
+        cache.popitem(last=False)
+    return cache, len(lines)
+
+def _append_llm_cache(line: bytes) -> None:
+    try:
+        LLM_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with LLM_CACHE_PATH.open("ab") as f:
+            f.write(line)
+    except OSError as e:
+        # Cache persistence is best-effort
+        print("LLM cache write error:", e)
+
+def _rewrite_llm_cache(items: List[Tuple[str, str]]) -> None:
+    # Replace the append-only log with just the live entries (oldest first)
+    tmp = LLM_CACHE_PATH.with_name(LLM_CACHE_PATH.name + ".tmp")
+    try:
+        LLM_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        tmp.write_bytes(b"".join(orjson.dumps({"key": k, "raw": raw}) + b"\n" for k, raw in items))
+        os.replace(tmp, LLM_CACHE_PATH)
+    except OSError as e:
+        print("LLM cache write error:", e)
+
+_LLM_CACHE, _llm_cache_lines = _load_llm_cache(LLM_CACHE_PATH)
+if _llm_cache_lines > 2 * LLM_CACHE_SIZE:
+    _llm_cache_lines = len(_LLM_CACHE)
+    _IO_POOL.submit(_rewrite_llm_cache, list(_LLM_CACHE.items()))
+
+def _llm_cache_get(key: str) -> str | None:
+    with _LLM_CACHE_LOCK:
+        raw = _LLM_CACHE.get(key)
+        if raw is not None:
+            _LLM_CACHE.move_to_end(key)
+        return raw
+
+def _llm_cache_put(key: str, raw: str) -> None:
+    global _llm_cache_lines
+    with _LLM_CACHE_LOCK:
+        _LLM_CACHE[key] = raw
+        _LLM_CACHE.move_to_end(key)
+        while len(_LLM_CACHE) > LLM_CACHE_SIZE:
+            _LLM_CACHE.popitem(last=False)
+        _llm_cache_lines += 1
+        if _llm_cache_lines > 2 * LLM_CACHE_SIZE:
+            # Log has grown well past what is kept: compact it instead of appending
+            _llm_cache_lines = len(_LLM_CACHE)
+            _IO_POOL.submit(_rewrite_llm_cache, list(_LLM_CACHE.items()))
+        else:
+            _IO_POOL.submit(_append_llm_cache, orjson.dumps({"key": key, "raw": raw}) + b"\n")
+
+def _llm_cache_drop(key: str) -> None:
+    with _LLM_CACHE_LOCK:
+        _LLM_CACHE.pop(key, None)
+
+# ---------- Sentence-level TTS ----------
+# Each sentence is synthesized as its own ElevenLabs call so they run concurrently
+# (and can start while Gemini is still streaming); the MP3s are then concatenated.
+# All TTS I/O (voice setup included) runs on this pool, never on the thread
+# consuming the Gemini stream, so token updates are not held up by ElevenLabs.
+TTS_POOL = ThreadPoolExecutor(max_workers=4)
+_VOICE_LOCK = threading.Lock()
+
+_SENT_SPLIT = re.compile(r'(?<=[.!?])\s+')
+
+def split_sentences(text: str) -> List[str]:
+    return [s for s in _SENT_SPLIT.split(text.strip()) if s]
+
+def _coerce_speaker(speaker: Optional[str]) -> str:
+    # If model picked an unknown speaker, coerce to Narrator (safer for TTS)
+    if speaker not in CHAR_NAMES_SET and speaker != "Narrator":
+        return "Narrator"
+    return speaker
+
+def _tts_cache_path(speaker: str, text: str, audio_cache_dir: str) -> Path:
+    # Keyed by (speaker, text) so repeated stock lines never hit ElevenLabs again
+    safe = safe_filename(speaker)
+    h = hashlib.sha256((speaker + "||" + text).encode("utf-8")).hexdigest()[:16]
+    return Path(audio_cache_dir) / "tts" / f"{safe or 'character'}-{h}.mp3"
+
+def _cached_tts(speaker: str, text: str, audio_cache_dir: str) -> str:
+    cache_path = _tts_cache_path(speaker, text, audio_cache_dir)
+    if cache_path.exists():
+        return str(cache_path)
+    # Serialized so parallel sentences don't each design a voice and race on characters.json
+    with _VOICE_LOCK:
+        ensure_voice_id_for_character_in_file(speaker, str(CHAR_PATH))
+    # Synthesize straight into the cache dir and rename, so each line is stored once
+    mp3_path = synthesize_line_mp3(
+        character_target=speaker,
+        text=text,
+        characters_path=str(CHAR_PATH),
+        out_dir=str(cache_path.parent)
+    )
+    try:
+        os.replace(mp3_path, cache_path)
+    except FileNotFoundError:
+        # A concurrent task for the same sentence was handed the same file and
+        # already renamed it to this cache_path
+        if not cache_path.exists():
+            raise
+    return str(cache_path)
+
+def _submit_tts(speaker: str, sentence: str, audio_cache_dir: str) -> Future:
+    return TTS_POOL.submit(_cached_tts, speaker, sentence, audio_cache_dir)
+
+@functools.lru_cache(maxsize=128)
+def _read_mp3(path: str) -> bytes:
+    # Safe to memoize: cache files are content-addressed and never rewritten
+    return Path(path).read_bytes()
+
+def _concat_mp3(paths: List[str], speaker: str, text: str, audio_cache_dir: str) -> str:
+    # Same voice + codec, so raw frame concatenation yields a playable MP3
+    if len(paths) == 1:
+        return paths[0]
+    out_path = _tts_cache_path(speaker, text, audio_cache_dir)
+    atomic_write_bytes(out_path, b"".join(_read_mp3(p) for p in paths))
+    return str(out_path)
+
 # ---------- Context helpers ----------
 def last_n_messages(history: List[Tuple[str, str]], n: int = 20) -> List[Tuple[str, str]]:
     # history is a list of ("You"/"Bot", message)
@@ -73,108 +259,182 @@ def history_as_transcript(history_slice: List[Tuple[str, str]]) -> str:
         lines.append(f"{who}: {msg}")
     return "\n".join(lines)
 
+# Matches `"key": "value...` even when the closing quote hasn't streamed in yet
+_PARTIAL_FIELDS = {
+    key: re.compile(r'"%s"\s*:\s*"((?:[^"\\]|\\.)*)' % key)
+    for key in ("speaker", "text")
+}
+
+def _partial_json_string(buf: str, key: str) -> Optional[str]:
+    """Best-effort read of a (possibly still unterminated) string field from streamed JSON."""
+    m = _PARTIAL_FIELDS[key].search(buf)
+    if not m:
+        return None
+    val = m.group(1)
+    if val.endswith("\\"):
+        val = val[:-1]  # dangling escape, wait for the next chunk
+    try:
+        return orjson.loads('"' + val + '"')
+    except ValueError:
+        return val
+
+def build_prompt(user_message: str, history: List[Tuple[str, str]]) -> str:
+    # Only the per-turn parts are built here; everything static lives in PROMPT_PREFIX
+    transcript = history_as_transcript(last_n_messages(history, 20))
+    return (
+        PROMPT_PREFIX +
+        "CONTEXT (recent chat transcript):\n"
+        f"{transcript}\n\n"
+        f"User: {user_message}"
+    )
+
 # ---------- Main entrypoint ----------
-def generate_text_and_audio(
+def stream_text_and_audio(
     user_message: str,
     history: List[Tuple[str, str]],
-    audio_cache_dir: str = "assets"
-) -> Dict[str, Any]:
+    audio_cache_dir: str = "assets",
+    session_id: Optional[str] = None
+) -> Iterator[Dict[str, Any]]:
     """
-    Orchestrates:
-      - Build context (last 20 msgs)
-      - Provide characters + setting
-      - Ask Gemini for strict JSON {speaker, text, location}
-      - Ensure a voice, synthesize MP3 (Eleven v3 Alpha via tts.py)
-      - Return dict ready for UI rendering
+    Streaming variant of generate_text_and_audio.
 
-    Returns dict with keys:
-      speaker, text, location, display_line, audio_src_base64, audio_path
+    Yields partial {speaker, text, done=False} updates while Gemini is still
+    generating, then one final dict with the same keys as generate_text_and_audio
+    plus done=True once the JSON is parsed and the MP3 is synthesized.
     """
-    # 1) Build context
-    ctx_slice = last_n_messages(history, 20)
-    transcript = history_as_transcript(ctx_slice)
-
-    # 2) World briefs (short to keep prompt small)
-    char_briefs = [
-        f"{c.get('name')}: {(c.get('personality') or '')} | {(c.get('background') or '')}"
-        for c in CHARACTERS
-    ]
-    locations_brief = ", ".join(LOCATION_IDS)
-
-    # 3) Compose a single prompt string (single turn)
-    prompt = (
-        ROLE + "\n"
-        "CONTEXT (recent chat transcript):\n"
-        f"{transcript}\n\n"
-        "WORLD DATA:\n"
-        "Characters:\n- " + "\n- ".join(char_briefs[:60]) + "\n\n"
-        "Known locations: " + locations_brief + "\n\n"
-        "TASK:\n"
-        "Using the world data, produce an in-world response as either an appropriate character "
-        "or the Narrator, if an appropriate character to respond is not available. You can be verbose, but "
-        "do not go beyond five sentences. You may include bracketed directions like [cautiously] "
-        "at the start of the line to express emotion or voice acting direction.\n\n"
-        "At all costs to maintain immersion, you are not to acknowledge that you are an AI or virtual assistant. If "
-        "the input response from the player is immersion breaking (i.e. dropping a nuclear bomb in a medieval setting), "
-        "do not allow it and instead reframe the response to be in universe (i.e. 'Narrator: Although you say this, you do not "
-        "know what a nuclear bomb is'). Only allow the player to do actions that are capable for humans to do in this fantasy medieval setting. "
-        "Also, do not allow the player to direct the actions of others. Only do so in context that makes sense (i.e. the player cannot specify "
-        "that a character performed a specific action, but can see another character performing an action)"
-        "\n\n"
-        + RESPONSE_SCHEMA + "\n\n"
-        f"User: {user_message}"
-    )
+    # 0) Semantic cache: near-duplicate turns skip both Gemini and TTS
+    last_reply = next((msg for sender, msg in reversed(history) if sender != "You"), "")
+    q = None
+    try:
+        q = semantic_cache.embed(client, semantic_cache.build_query(user_message, last_reply))
+        cached = semantic_cache.lookup(q, session_id)
+        if cached:
+            yield cached | {"done": True}
+            return
+    except Exception as e:
+        # Cache is an optimization only; fall through to a live call
+        print("Semantic cache error:", e)
 
-    # 4) Call Gemini — pass a SINGLE Content object (or pass prompt as a plain string)
-    resp = client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents={"role": "user", "parts": [{"text": prompt}]}
-        # Note: no system_instruction / generation_config here
-    )
+    # 1-3) Context + world data + instructions as one prompt string
+    prompt = build_prompt(user_message, history)
 
-    raw = (resp.text or "").strip()
+    # 4) Stream from Gemini (skipped on an exact-match cache hit)
+    key = _cache_key(GEMINI_MODEL, prompt)
+    raw = _llm_cache_get(key)
+    from_cache = raw is not None
+    tts_speaker: Optional[str] = None
+    pending: List[Tuple[str, Future]] = []  # (sentence, mp3 future), in order
+    if raw is None:
+        buf = ""
+        shown = ""
+        # Pass a SINGLE Content object (or pass prompt as a plain string)
+        for chunk in client.models.generate_content_stream(
+            model=GEMINI_MODEL,
+            contents={"role": "user", "parts": [{"text": prompt}]},
+            config={"response_mime_type": "application/json", "response_schema": _response_schema()}
+        ):
+            buf += chunk.text or ""
+            partial_text = _partial_json_string(buf, "text")
+            if partial_text and partial_text != shown:
+                shown = partial_text
+                partial_speaker = _partial_json_string(buf, "speaker")
 
-    # 5) Parse strict JSON; if it fails, fall back to Narrator with raw text
-    speaker = "Narrator"
-    text = raw
-    location = ""
-    try:
-        data = json.loads(raw)
-        speaker = data.get("speaker") or "Narrator"
-        text = data.get("text") or ""
-        location = data.get("location") or ""
-    except Exception:
-        pass
+                # Kick off TTS for every sentence that is already complete
+                if partial_speaker is not None:
+                    if tts_speaker is None:
+                        tts_speaker = _coerce_speaker(partial_speaker)
+                    complete = split_sentences(partial_text)[:-1]
+                    for sent in complete[len(pending):]:
+                        pending.append((sent, _submit_tts(tts_speaker, sent, audio_cache_dir)))
 
-    # If model picked an unknown speaker, coerce to Narrator (safer for TTS)
-    if speaker not in CHAR_NAMES and speaker != "Narrator":
-        speaker = "Narrator"
+                yield {
+                    "speaker": partial_speaker or "Narrator",
+                    "text": partial_text,
+                    "done": False,
+                }
+        raw = buf.strip()
+
+    # 5) Output is schema-validated JSON, unless the stream was cut short
+    #    (MAX_TOKENS, safety block, dropped connection). Only cache what parses.
+    try:
+        data = orjson.loads(raw) if raw else {}
+        if not isinstance(data, dict):
+            raise ValueError(f"expected a JSON object, got {type(data).__name__}")
+    except ValueError as e:
+        print("Gemini response parse error:", e)
+        # Degrade to whatever text made it through before the cut
+        data = {
+            "speaker": _partial_json_string(raw, "speaker"),
+            "text": _partial_json_string(raw, "text"),
+        }
+        if from_cache:
+            _llm_cache_drop(key)
+    else:
+        if raw and not from_cache:
+            _llm_cache_put(key, raw)
+    speaker = _coerce_speaker(data.get("speaker") or "Narrator")
+    text = data.get("text") or ""
+    location = data.get("location") or ""
 
     display_line = f"{speaker}: {text}"
 
-    # 6) TTS (ensures voice if missing, then synthesize; Eleven v3 Alpha inside synthesize_line_mp3)
+    # 6) TTS per sentence (ensures voice if missing, then synthesize; Eleven v3 Alpha inside synthesize_line_mp3)
     audio_path = None
-    audio_src_b64 = None
-    if text:
+    cache_path = _tts_cache_path(speaker, text, audio_cache_dir)
+    if text and cache_path.exists():
+        # Whole line already synthesized before: no ElevenLabs call
+        audio_path = str(cache_path)
+    elif text:
         try:
-            audio_path = synthesize_line_mp3(
-                character_target=speaker,
-                text=text,
-                characters_path=str(CHAR_PATH),
-                out_dir=audio_cache_dir
-            )
-            # Inline audio as base64 for Dash <audio>; avoids static routing
-            b = Path(audio_path).read_bytes()
-            audio_src_b64 = "data:audio/mpeg;base64," + base64.b64encode(b).decode("ascii")
+            sentences = split_sentences(text)
+            if tts_speaker != speaker or [s for s, _ in pending] != sentences[:len(pending)]:
+                # Streamed guess diverged from the parsed result; start over
+                pending = []
+            for sent in sentences[len(pending):]:
+                pending.append((sent, _submit_tts(speaker, sent, audio_cache_dir)))
+            audio_path = _concat_mp3([f.result() for _, f in pending], speaker, text, audio_cache_dir)
         except Exception as e:
             # Don’t crash chat if TTS fails
             print("TTS error:", e)
 
-    return {
+    result = {
         "speaker": speaker,
         "text": text,
         "location": location,
         "display_line": display_line,
-        "audio_src_base64": audio_src_b64,
         "audio_path": audio_path
     }
+
+    # 7) Remember this turn for future paraphrases (an exact-cache hit was
+    #    already answered once, so it would only add a duplicate row)
+    if q is not None and text and audio_path and not from_cache:
+        semantic_cache.store(q, result, session_id)
+
+    yield result | {"done": True}
+
+def generate_text_and_audio(
+    user_message: str,
+    history: List[Tuple[str, str]],
+    audio_cache_dir: str = "assets",
+    session_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Orchestrates:
+      - Reuse a semantically similar cached turn (text + MP3) if one exists
+      - Build context (last 20 msgs)
+      - Provide characters + setting
+      - Ask Gemini for schema-validated JSON {speaker, text, location}
+      - Ensure a voice, synthesize MP3 (Eleven v3 Alpha via tts.py)
+      - Return dict ready for UI rendering
+
+    Blocking wrapper around stream_text_and_audio that only returns the final result.
+
+    Returns dict with keys:
+      speaker, text, location, display_line, audio_path
+      (audio_path is relative to the app root, e.g. assets/tts/..., so Dash serves it statically)
+    """
+    result: Dict[str, Any] = {}
+    for result in stream_text_and_audio(user_message, history, audio_cache_dir, session_id):
+        pass
+    result.pop("done", None)
+    return result
@@ -0,0 +1,135 @@
+# semantic_cache.py
+"""
+Embedding-keyed response cache for generate_text_and_audio.
+
+Paraphrased follow-ups ("tell me more" vs "say more about that") miss the
+exact-match prompt cache, so we also keep recent answered turns as embedding
+rows in a NumPy matrix and reuse the stored response (and its MP3) when a new
+query is close enough by cosine similarity.
+
+Brute-force NumPy search is plenty at this scale; swap in FAISS/HNSWlib if the
+cache grows past ~10k rows.
+"""
+
+from __future__ import annotations
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import orjson
+
+# --------------------------- Config ---------------------------
+
+EMBED_MODEL = "text-embedding-004"
+SIMILARITY_THRESHOLD = 0.92
+# Rows kept in memory; the oldest are evicted first, like LLM_CACHE_SIZE
+SEMANTIC_CACHE_SIZE = 1024
+CACHE_DIR = Path("assets")
+MATRIX_PATH = CACHE_DIR / ".semantic_cache.npy"
+ENTRIES_PATH = CACHE_DIR / ".semantic_cache.json"
+
+# E is (N, dim); _ENTRIES[i] is the cached result for row i.
+# Both are shared by every request thread, so they are only touched under _LOCK
+# to keep row i and entry i in step.
+# Rows scoped to a session_id (one browser tab) are kept in memory only: once the
+# tab is gone they can never match again, so only unscoped rows are persisted.
+_E: Optional[np.ndarray] = None
+_ENTRIES: List[Dict[str, Any]] = []
+_LOCK = threading.Lock()
+
+# Persistence runs off the request thread; one worker keeps saves ordered
+_IO_POOL = ThreadPoolExecutor(max_workers=1)
+
+
+def _load() -> None:
+    global _E, _ENTRIES
+    if not (MATRIX_PATH.exists() and ENTRIES_PATH.exists()):
+        return
+    try:
+        E = np.load(MATRIX_PATH)
+        entries = orjson.loads(ENTRIES_PATH.read_bytes())
+    except Exception as e:
+        print("Semantic cache load error:", e)
+        return
+    if E.ndim != 2 or len(entries) != E.shape[0]:
+        return
+    # Older files may still hold session-scoped rows; drop them and apply the cap
+    keep = [i for i, e in enumerate(entries) if e.get("session_id") is None][-SEMANTIC_CACHE_SIZE:]
+    if keep:
+        _E, _ENTRIES = E[keep], [entries[i] for i in keep]
+
+
+def _save(E: np.ndarray, entries: List[Dict[str, Any]]) -> None:
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        np.save(MATRIX_PATH, E)
+        ENTRIES_PATH.write_bytes(orjson.dumps(entries))
+    except OSError as e:
+        # Persistence is best-effort
+        print("Semantic cache write error:", e)
+
+
+def build_query(user_message: str, last_reply: str = "") -> str:
+    """Text that gets embedded: the previous reply (for context) plus the new message."""
+    return f"{last_reply.strip()}\n{user_message.strip()}".strip()
+
+
+def embed(client, text: str) -> np.ndarray:
+    """Unit-normalized embedding so a dot product is cosine similarity."""
+    resp = client.models.embed_content(model=EMBED_MODEL, contents=text)
+    q = np.asarray(resp.embeddings[0].values, dtype=np.float32)
+    norm = np.linalg.norm(q)
+    return q / norm if norm else q
+
+
+def lookup(q: np.ndarray, session_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Return the cached result most similar to q, or None below the threshold."""
+    with _LOCK:
+        if _E is None or not len(_ENTRIES) or _E.shape[1] != q.shape[0]:
+            return None
+
+        # Rows are stored normalized, so E @ q is already the cosine score
+        scores = _E @ q
+        if session_id is not None:
+            mask = np.fromiter((e.get("session_id") == session_id for e in _ENTRIES), dtype=bool, count=len(_ENTRIES))
+            scores = np.where(mask, scores, -1.0)
+        idx = int(np.argmax(scores))
+        if scores[idx] < SIMILARITY_THRESHOLD:
+            return None
+
+        entry = _ENTRIES[idx]
+    audio_path = entry.get("audio_path")
+    if audio_path and not Path(audio_path).exists():
+        return None
+    return entry["result"] | {"audio_path": audio_path}
+
+
+def store(q: np.ndarray, result: Dict[str, Any], session_id: Optional[str] = None) -> None:
+    """Append a new row/entry pair; unscoped rows are also persisted in the background."""
+    global _E
+    row = q.reshape(1, -1).astype(np.float32)
+    entry = {
+        "session_id": session_id,
+        "audio_path": result.get("audio_path"),
+        "result": {k: result.get(k) for k in ("speaker", "text", "location", "display_line")},
+    }
+    with _LOCK:
+        if _E is None or _E.shape[1] != row.shape[1]:
+            _E = row
+            _ENTRIES.clear()
+        else:
+            _E = np.vstack([_E[-(SEMANTIC_CACHE_SIZE - 1):], row])
+            del _ENTRIES[:-(SEMANTIC_CACHE_SIZE - 1)]
+        _ENTRIES.append(entry)
+        if session_id is not None:
+            return
+        # _E is rebound (never mutated) on append, so this is a consistent
+        # snapshot even if another store() runs before the save does
+        keep = [i for i, e in enumerate(_ENTRIES) if e.get("session_id") is None]
+        snapshot = (_E[keep], [_ENTRIES[i] for i in keep])
+    _IO_POOL.submit(_save, *snapshot)
+
+
+_load()
@@ -11,7 +11,7 @@ from dotenv import load_dotenv
 # Import your previously defined function (adjust path/module if needed)
 # from ensure_voice import ensure_voice_id_for_character_in_file
 # If ensure_voice.py is in the same dir, this import works:
-from tts import ensure_voice_id_for_character_in_file
+from tts import ensure_voice_id_for_character_in_file, safe_filename, SESSION
 
 load_dotenv()
 ELEVEN_API_KEY = os.getenv("ELEVEN_API_KEY")
@@ -30,10 +30,6 @@ def _headers_for_tts():
         "content-type": "application/json",
     }
 
-def _safe_filename(s: str) -> str:
-    return "".join(c for c in s.lower().replace(" ", "-") if c.isalnum() or c in ("-", "_"))
-
-
 def _hash_for(text: str, voice_id: str) -> str:
     return hashlib.sha256((voice_id + "||" + text).encode("utf-8")).hexdigest()[:12]
 
@@ -94,7 +90,7 @@ def synthesize_random_directional_sample_mp3(
 
     # 3) Prepare output path (cache by voice+text)
     Path(out_dir).mkdir(parents=True, exist_ok=True)
-    name_part = _safe_filename(str(character_target))
+    name_part = safe_filename(str(character_target))
     hash_part = _hash_for(text, voice_id)
     out_path = Path(out_dir) / f"{name_part or 'character'}-{hash_part}.mp3"
     if out_path.exists():
@@ -109,7 +105,7 @@ def synthesize_random_directional_sample_mp3(
         # "voice_settings": {"stability": 0.4, "similarity_boost": 0.75}
     }
 
-    r = requests.post(url, headers=_headers_for_tts(), json=payload, timeout=120)
+    r = SESSION.post(url, headers=_headers_for_tts(), json=payload, timeout=120)
     if r.status_code >= 400:
         raise ElevenError(f"TTS failed: {r.status_code} {r.text}")
 
@@ -13,8 +13,12 @@ Highlights:
 
 import os
 import json
+import tempfile
 from typing import Dict, List, Optional, Union
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -25,6 +29,11 @@ ELEVEN_API_KEY = os.getenv("ELEVEN_API_KEY")
 ELEVEN_MODEL_ID = "eleven_v3"
 BASE = "https://api.elevenlabs.io/v1"
 
+# One pooled keep-alive session so repeated ElevenLabs calls skip the TCP/TLS handshake
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16,
+                                       max_retries=Retry(total=2, backoff_factor=0.3)))
+
 class ElevenError(RuntimeError):
     pass
 
@@ -47,8 +56,27 @@ def _headers_for_tts():
         "content-type": "application/json",
     }
 
-def _safe_filename(s: str) -> str:
-    return "".join(c for c in s.lower().replace(" ", "-") if c.isalnum() or c in ("-", "_"))
+# Deletes every ASCII char that isn't alphanumeric, '-' or '_' in one C-level pass
+_SAFE_TABLE = str.maketrans({c: None for c in map(chr, range(128)) if not (c.isalnum() or c in "-_")})
+
+def safe_filename(s: str) -> str:
+    s = s.lower().replace(" ", "-")
+    if s.isascii():
+        return s.translate(_SAFE_TABLE)
+    return "".join(c for c in s if c.isalnum() or c in ("-", "_"))
+
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    # Write to a temp file in the same directory, then rename over the target, so
+    # readers that trust exists() never see a half-written MP3
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
 
 
 def _hash_for(text: str, voice_id: str) -> str:
@@ -75,7 +103,7 @@ def _design_voice_from_prompt(prompt: str, design_text: str) -> str:
 
     # Try create-previews first
     url1 = f"{BASE}/text-to-voice/create-previews"
-    r1 = requests.post(url1, headers=_headers(), json=payload, timeout=60)
+    r1 = SESSION.post(url1, headers=_headers(), json=payload, timeout=60)
 
     if r1.status_code == 200:
         gen_id = r1.headers.get("generated_voice_id")
@@ -91,7 +119,7 @@ def _design_voice_from_prompt(prompt: str, design_text: str) -> str:
 
     # Fallback legacy endpoint
     url2 = f"{BASE}/text-to-voice/design"
-    r2 = requests.post(url2, headers=_headers(), json=payload, timeout=60)
+    r2 = SESSION.post(url2, headers=_headers(), json=payload, timeout=60)
     if r2.status_code == 200:
         data2 = r2.json()
         previews2 = data2.get("previews", [])
@@ -124,7 +152,7 @@ def _create_voice_from_generated(generated_voice_id: str, name: str, description
         "name": (name or "RPG Character")[:50],
         "description": (description or "Generated by Voice Design")[:200],
     }
-    r = requests.post(url, headers=_headers(), json=payload, timeout=60)
+    r = SESSION.post(url, headers=_headers(), json=payload, timeout=60)
     if r.status_code >= 400:
         raise ElevenError(f"Create voice failed: {r.status_code} {r.text}")
     data = r.json()
@@ -136,7 +164,7 @@ def _create_voice_from_generated(generated_voice_id: str, name: str, description
 
 def _fallback_pick_existing_voice_id() -> Optional[str]:
     url = f"{BASE}/voices"
-    r = requests.get(url, headers=_headers(json_content=False), timeout=30)
+    r = SESSION.get(url, headers=_headers(json_content=False), timeout=30)
     if r.status_code >= 400:
         return None
     data = r.json()
@@ -146,7 +174,7 @@ def _fallback_pick_existing_voice_id() -> Optional[str]:
 
 def _list_voice_ids() -> List[str]:
     url = f"{BASE}/voices"
-    r = requests.get(url, headers=_headers(json_content=False), timeout=30)
+    r = SESSION.get(url, headers=_headers(json_content=False), timeout=30)
     r.raise_for_status()
     return [v.get("voice_id") for v in r.json().get("voices", [])]
 
@@ -154,13 +182,13 @@ def _list_voice_ids() -> List[str]:
 # ---------------------- File & character IO -------------------
 
 def _load_characters(path: str) -> List[Dict]:
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return orjson.loads(Path(path).read_bytes())
 
 
 def _save_characters(path: str, characters: List[Dict]) -> None:
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(characters, f, ensure_ascii=False, indent=2)
+    # Atomic so a concurrent _load_characters never reads a truncated file
+    data = json.dumps(characters, ensure_ascii=False, indent=2).encode("utf-8")
+    atomic_write_bytes(Path(path), data)
 
 
 def _find_character(characters: List[Dict], target: str) -> Dict:
@@ -238,7 +266,7 @@ def synthesize_voice_mp3(
     voice_id = ensure_voice_id_for_character_in_file(character_target, characters_path)
 
     #Path(out_dir).mkdir(parents=True, exist_ok=True)
-    name_part = _safe_filename(str(character_target))
+    name_part = safe_filename(str(character_target))
     hash_part = _hash_for(text, voice_id)
     out_path = Path(out_dir) / f"{name_part or 'character'}-{hash_part}.mp3"
     if out_path.exists():
@@ -253,7 +281,7 @@ def synthesize_voice_mp3(
         # "voice_settings": {"stability": 0.4, "similarity_boost": 0.75}
     }
 
-    r = requests.post(url, headers=_headers_for_tts(), json=payload, timeout=120)
+    r = SESSION.post(url, headers=_headers_for_tts(), json=payload, timeout=120)
     if r.status_code >= 400:
         raise ElevenError(f"TTS failed: {r.status_code} {r.text}")
 
@@ -266,9 +294,9 @@ def synthesize_line_mp3(character_target, text, characters_path="characters.json
     out_dir_path = Path(out_dir)
     out_dir_path.mkdir(parents=True, exist_ok=True)
 
-    import hashlib, requests, os
+    import hashlib, os
     h = hashlib.sha256((voice_id + "||" + text).encode()).hexdigest()[:12]
-    safe = "".join(c for c in str(character_target).lower().replace(" ", "-") if c.isalnum() or c in "-_")
+    safe = safe_filename(str(character_target))
     out_path = out_dir_path / f"{safe}-{h}.mp3"
     if out_path.exists():
         return str(out_path)
@@ -278,7 +306,7 @@ def synthesize_line_mp3(character_target, text, characters_path="characters.json
                "content-type": "application/json"}
     url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
     payload = {"text": text, "model_id": model_id}
-    r = requests.post(url, headers=headers, json=payload, timeout=120)
+    r = SESSION.post(url, headers=headers, json=payload, timeout=120)
     r.raise_for_status()
-    out_path.write_bytes(r.content)
+    atomic_write_bytes(out_path, r.content)
     return str(out_path)
\ No newline at end of file